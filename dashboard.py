@@ -2,9 +2,18 @@ import dash
 from dash import dcc, html, Input, Output, State
 import plotly.graph_objs as go
 import pandas as pd
+import numpy as np
 import time
 import os
 import random
+import atexit
+import re
+import queue
+import gzip
+import shutil
+import glob
+import functools
+import threading
 
 # 🔹 Detect if running on Railway
 ON_RAILWAY = os.environ.get("RAILWAY") is not None
@@ -26,173 +35,730 @@ else:
 
 # File for CSV Storage
 CSV_FILE = "sensor_data.csv"
-
-# Ensure CSV file exists
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, "w") as file:
-        file.write("Timestamp,Temperature,Humidity\n")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Older data is rolled over into compressed daily archives, loaded only for "Show All"
+ROLLOVER_BYTES = 10 * 1024 * 1024  # Also roll over once the CSV grows past this size
+ARCHIVE_PATTERN = "sensor_data.*.csv.gz"
+_ARCHIVES = ()  # Archive files present at startup
+
+# Feather snapshot of the history, so startup doesn't have to parse the whole CSV.
+# The CSV stays the durable log; the snapshot is only a load cache.
+SNAPSHOT_FILE = "sensor_data.feather"
+SNAPSHOT_EVERY = 1000  # Refresh the snapshot every N new samples
+_snapshot_n = 0  # Sample count when the snapshot was last written
+_snapshot_ok = True  # False if the CSV couldn't be loaded, so a snapshot would leave its rows out
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    print("⚠️ pyarrow not installed: history snapshots are disabled.")
+    feather = None
+
+def local_offsets(ts):
+    """ Returns the local UTC offset in seconds for each epoch timestamp, following DST like time.localtime. """
+    # Offsets only change on quarter-hour boundaries, so look each bucket up once
+    buckets, inverse = np.unique(np.floor_divide(ts, 900), return_inverse=True)
+    offsets = np.array([time.localtime(b * 900).tm_gmtoff for b in buckets], dtype=np.float64)
+    return offsets[inverse.reshape(-1)]
+
+def from_local(wall):
+    """ Converts local wall-clock seconds (as written to the CSV) back to epoch seconds. """
+    return wall - local_offsets(wall - local_offsets(wall))
+
+# In-memory sample history (epoch seconds, °C, %). The CSV is only written to after startup.
+# Columns are preallocated numpy arrays that double in size as they fill up. On Railway the
+# history is a ring buffer that keeps only the newest RING_SIZE samples so memory stays bounded.
+RING_SIZE = 10000
+HISTORY_CAPACITY = 2 * RING_SIZE if ON_RAILWAY else 1024
+_HISTORY = {
+    "ts": np.empty(HISTORY_CAPACITY, dtype=np.float64),
+    "temp": np.empty(HISTORY_CAPACITY, dtype=np.float64),
+    "hum": np.empty(HISTORY_CAPACITY, dtype=np.float64),
+}
+_first = 0  # Index of the oldest sample still in the history
+_n = 0  # Index one past the newest sample
+
+def history(key):
+    """ Returns a zero-copy view of the samples currently held in a history column. """
+    return _HISTORY[key][_first:_n]
+
+def append_history(ts, temp, hum):
+    """ Appends arrays of samples to the history, making room for them first. """
+    global _first, _n
+    count = len(ts)
+    size = _HISTORY["ts"].size
+    if _n + count > size:
+        if ON_RAILWAY:
+            # Start over with just the newest samples instead of growing (fresh arrays, so views stay valid)
+            keep = min(_n - _first, RING_SIZE)
+            for key, arr in _HISTORY.items():
+                fresh = np.empty_like(arr)
+                fresh[:keep] = arr[_n - keep:_n]
+                _HISTORY[key] = fresh
+            _first, _n = 0, keep
+        else:
+            while _n + count > size:
+                size *= 2
+            for key, arr in _HISTORY.items():
+                _HISTORY[key] = np.resize(arr, size)
+
+    _HISTORY["ts"][_n:_n + count] = ts
+    _HISTORY["temp"][_n:_n + count] = temp
+    _HISTORY["hum"][_n:_n + count] = hum
+    _n += count
+    if ON_RAILWAY:
+        _first = max(_first, _n - RING_SIZE)
+
+# Running statistics over the full history, updated as samples arrive
+_stats = {"n": 0, "tsum": 0.0, "hsum": 0.0, "tmin": float("inf"), "tmax": float("-inf")}
+
+def parse_csv(source, **kwargs):
+    """ Parses sensor CSV rows into epoch seconds (ts), temperatures (temp) and humidities (hum). """
+    df = pd.read_csv(
+        source,
+        usecols=["Timestamp", "Temperature", "Humidity"],
+        dtype={"Temperature": "float64", "Humidity": "float64"},
+        parse_dates=["Timestamp"],
+        date_format=TIME_FORMAT,
+        engine="c",
+        **kwargs,
+    )
+    # A malformed timestamp leaves the column unparsed; coerce those rows to NaT
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], format=TIME_FORMAT, errors='coerce', cache=True)
+    df = df.dropna()
+    ts = from_local((df["Timestamp"] - pd.Timestamp(0)).dt.total_seconds().to_numpy())
+    return pd.DataFrame({"ts": ts, "temp": df["Temperature"].to_numpy(), "hum": df["Humidity"].to_numpy()})
+
+def load_snapshot():
+    """ Returns the Feather snapshot and the CSV byte offset it covers, or (None, 0) if it can't be used. """
+    if feather is None or not os.path.exists(SNAPSHOT_FILE):
+        return None, 0
+    try:
+        table = feather.read_table(SNAPSHOT_FILE)
+        return table.to_pandas().dropna(), int(table.schema.metadata[b"csv_offset"])
+    except (OSError, KeyError, TypeError, ValueError, pa.ArrowException) as e:
+        print(f"⚠️ Ignoring unreadable snapshot {SNAPSHOT_FILE}: {e}")
+        return None, 0
+
+def snapshot_columns():
+    """ Returns the history views and CSV offset to snapshot, or None if snapshots are off. Call with _HISTORY_LOCK held. """
+    global _snapshot_n
+    if feather is None or not _snapshot_ok:
+        return None
+    _snapshot_n = _stats["n"]
+    # Views stay valid after the lock is released: appends only write past _n or into fresh arrays
+    return {key: history(key) for key in _HISTORY}, _history_csv_end
+
+def save_snapshot(columns, csv_end):
+    """ Writes history columns to the Feather snapshot. Runs outside _HISTORY_LOCK so callbacks aren't held up. """
+    table = pa.table(columns).replace_schema_metadata({"csv_offset": str(csv_end)})
+    with _SNAPSHOT_LOCK:  # The periodic and shutdown snapshots share the temporary file
+        feather.write_feather(table, SNAPSHOT_FILE + ".tmp")
+        os.replace(SNAPSHOT_FILE + ".tmp", SNAPSHOT_FILE)  # Never leave a half-written snapshot behind
+
+def load_history():
+    """ Loads the saved history once at startup so the dashboard never has to re-read it. """
+    global _history_csv_end, _snapshot_n
+    df, offset = load_snapshot()
+    with open(CSV_FILE, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if df is None or offset > size:  # No snapshot, or the CSV was replaced since it was taken
+            df = parse_csv(file)
+        elif offset < size:  # Only parse the rows appended after the snapshot
+            file.seek(offset)
+            df = pd.concat([df, parse_csv(file, header=None, names=["Timestamp", "Temperature", "Humidity"])])
+    _history_csv_end = size
+
+    append_history(df["ts"].to_numpy(), df["temp"].to_numpy(), df["hum"].to_numpy())
+
+    if not df.empty:
+        _stats["n"] += len(df)
+        _stats["tsum"] += df["temp"].sum()
+        _stats["hsum"] += df["hum"].sum()
+        _stats["tmin"] = min(_stats["tmin"], df["temp"].min())
+        _stats["tmax"] = max(_stats["tmax"], df["temp"].max())
+    _snapshot_n = _stats["n"] if offset == size else 0
+
+def rollover_csv():
+    """ Compresses the CSV into a dated archive if it's from an earlier day or too large, so startup only loads today's data. """
+    if not os.path.exists(CSV_FILE):
+        return
+    info = os.stat(CSV_FILE)
+    day = time.strftime("%Y-%m-%d", time.localtime(info.st_mtime))
+    if day == time.strftime("%Y-%m-%d") and info.st_size <= ROLLOVER_BYTES:
+        return
+
+    archive = f"sensor_data.{day}.csv.gz"
+    suffix = 1
+    while os.path.exists(archive):  # Rolled over more than once that day
+        archive = f"sensor_data.{day}.{suffix}.csv.gz"
+        suffix += 1
+
+    with open(CSV_FILE, "rb") as file, gzip.open(archive, "wb") as gz:
+        shutil.copyfileobj(file, gz)
+    os.remove(CSV_FILE)
+    if os.path.exists(SNAPSHOT_FILE):  # The snapshot describes the old CSV
+        os.remove(SNAPSHOT_FILE)
+    print(f"📦 Rolled {CSV_FILE} over into {archive}")
+
+def combine_stats(a, b):
+    """ Combines two sets of statistics shaped like _stats. """
+    return {
+        "n": a["n"] + b["n"], "tsum": a["tsum"] + b["tsum"], "hsum": a["hsum"] + b["hsum"],
+        "tmin": min(a["tmin"], b["tmin"]), "tmax": max(a["tmax"], b["tmax"]),
+    }
+
+# Downsampled archive points (ts, temp, hum) and their statistics, filled in by a background thread at
+# startup so "Show All" never decompresses archives inside a request or keeps every archived row in memory
+_archive_summary = None
+
+def summarize_archives(paths):
+    """ Parses each archive once, keeping only a downsampled copy of its points plus its statistics. """
+    global _archive_summary
+    parts = []
+    totals = {"n": 0, "tsum": 0.0, "hsum": 0.0, "tmin": float("inf"), "tmax": float("-inf")}
+    for path in paths:
+        try:
+            df = parse_csv(path)
+        except (OSError, EOFError, ValueError) as e:  # Truncated or corrupt archive
+            print(f"⚠️ Skipping unreadable archive {path}: {e}")
+            continue
+        if df.empty:
+            continue
+        totals = combine_stats(totals, {
+            "n": len(df), "tsum": df["temp"].sum(), "hsum": df["hum"].sum(),
+            "tmin": df["temp"].min(), "tmax": df["temp"].max(),
+        })
+        parts.append(downsample(df["ts"].to_numpy(), df["temp"].to_numpy(), df["hum"].to_numpy()))
+
+    # Concatenating copies the kept points, so the full archive columns can be freed
+    ts, temps, hums = (np.concatenate([part[i] for part in parts] or [np.empty(0)]) for i in range(3))
+    order = np.argsort(ts, kind="stable")  # Same-day rollovers don't sort by file name
+    _archive_summary = (ts[order], temps[order], hums[order], totals)
+    print(f"📦 Loaded {totals['n']} archived samples from {len(paths)} archives")
+
+# Samples read by the background serial thread, waiting to be added to the history
+_Q = queue.Queue()
+_HISTORY_LOCK = threading.Lock()
+_SNAPSHOT_LOCK = threading.Lock()
+
+# Keep the CSV open for the lifetime of the process instead of reopening it per sample
+CSV_FLUSH_EVERY = 50  # Flush buffered rows to disk every N samples
+_CSV_FH = None
+_csv_pending = 0
+_csv_size = 0  # Bytes written to the CSV so far, including buffered rows
+_history_csv_end = 0  # CSV byte offset up to which rows are in the history
+
+def close_csv():
+    """ Flushes buffered rows and syncs the CSV to disk on shutdown. """
+    _CSV_FH.flush()
+    os.fsync(_CSV_FH.fileno())
+    _CSV_FH.close()
+
+def shutdown_snapshot():
+    """ Saves a final snapshot so the next start can skip parsing the CSV. """
+    drain_queue()
+    with _HISTORY_LOCK:
+        snapshot = snapshot_columns()
+    if snapshot is not None:
+        save_snapshot(*snapshot)
+
+# Last formatted second, reused while a burst of serial lines shares the same timestamp
+_ts_cache = (None, "")
+
+def format_time(now):
+    """ Formats epoch seconds with TIME_FORMAT, reusing the previous result within the same second. """
+    global _ts_cache
+    second = int(now)
+    if _ts_cache[0] != second:
+        _ts_cache = (second, time.strftime(TIME_FORMAT, time.localtime(second)))
+    return _ts_cache[1]
+
+def record_sample(temp, hum):
+    """ Writes a sample to the CSV (off Railway) and queues it for the dashboard. Runs on the serial thread. """
+    global _csv_pending, _csv_size
+    now = time.time()
+    timestamp = format_time(now)
+
+    if _CSV_FH is not None:
+        row = f"{timestamp},{temp},{hum}\n"
+        _CSV_FH.write(row)
+        _csv_size += len(row)  # Rows are plain ASCII, so characters == bytes
+        _csv_pending += 1
+        if _csv_pending >= CSV_FLUSH_EVERY:
+            _CSV_FH.flush()
+            _csv_pending = 0
+
+    _Q.put((now, temp, hum, _csv_size))
+
+def add_sample(now, temp, hum):
+    """ Appends a sample to the in-memory history and running statistics. """
+    append_history((now,), (temp,), (hum,))
+
+    _stats["n"] += 1
+    _stats["tsum"] += temp
+    _stats["hsum"] += hum
+    _stats["tmin"] = min(_stats["tmin"], temp)
+    _stats["tmax"] = max(_stats["tmax"], temp)
+
+def drain_queue():
+    """ Moves every sample queued by the serial thread into the history without blocking. """
+    global _history_csv_end
+    snapshot = None
+    with _HISTORY_LOCK:
+        while True:
+            try:
+                now, temp, hum, csv_end = _Q.get_nowait()
+            except queue.Empty:
+                break
+            add_sample(now, temp, hum)
+            _history_csv_end = csv_end
+
+        if not ON_RAILWAY and _stats["n"] - _snapshot_n >= SNAPSHOT_EVERY:
+            snapshot = snapshot_columns()
+
+    # Write the snapshot in the background so this callback doesn't wait on the disk either
+    if snapshot is not None:
+        threading.Thread(target=save_snapshot, args=snapshot, daemon=True).start()
+
+def read_history():
+    """ Returns views of the ts, temp and hum columns plus a copy of _stats, all taken together under the lock. """
+    with _HISTORY_LOCK:
+        return history("ts"), history("temp"), history("hum"), dict(_stats)
+
+def to_datetime(ts):
+    """ Converts epoch seconds to naive local timestamps for plotting. """
+    ts = np.asarray(ts, dtype=np.float64)
+    return pd.to_datetime(ts + local_offsets(ts), unit="s")
+
+# Dash Layout
+def build_layout():
+    """ Builds the dashboard layout. """
+    return html.Div([
+        html.H1("Hybrid System Dashboard", style={'textAlign': 'center'}),
+
+        # Alert Message
+        html.Div(id="alert-message", style={'textAlign': 'center', 'color': 'red', 'fontSize': '20px'}),
+
+        # Live Mode Toggle
+        html.Div([
+            html.Label("Live Mode:"),
+            dcc.RadioItems(
+                id='live-mode',
+                options=[
+                    {'label': 'ON (Real-Time Updates)', 'value': 'on'},
+                    {'label': 'OFF (Pause Graph)', 'value': 'off'}
+                ],
+                value='on',
+                inline=True
+            )
+        ], style={'textAlign': 'center', 'margin': '10px'}),
+
+        # Time Range Filter
+        html.Label("Select Time Range:"),
+        dcc.Dropdown(
+            id='time-filter',
+            options=[
+                {'label': 'Last 5 minutes', 'value': '5'},
+                {'label': 'Last 10 minutes', 'value': '10'},
+                {'label': 'Last 30 minutes', 'value': '30'},
+                {'label': 'Show All', 'value': 'all'}
+            ],
+            value='all',
+            clearable=False,
+            style={'width': '50%'}
+        ),
+
+        # Real-Time Statistics
+        html.Div([
+            html.H3("Current Sensor Data"),
+            html.P(id="current-temp"),
+            html.P(id="current-hum"),
+            html.H3("Statistics"),
+            html.P(id="avg-temp"),
+            html.P(id="avg-hum"),
+            html.P(id="max-temp"),
+            html.P(id="min-temp")
+        ], style={'textAlign': 'center', 'border': '2px solid #ccc', 'padding': '10px', 'margin': '10px'}),
+
+        dcc.Graph(id='live-graph', config={'scrollZoom': True}),
+        dcc.Store(id='graph-cursor'),  # What the client's graph currently contains (see render)
+        dcc.Store(id='stats-store'),  # Latest statistics, rendered into text in the browser
+
+        html.Div([
+            html.Button("Download CSV", id="download-btn"),
+            dcc.Download(id="download-dataframe-csv"),
+        ], style={'textAlign': 'center', 'margin': '20px'}),
+
+        dcc.Interval(
+            id='interval-component',
+            interval=2000,  # Update every 2 seconds
+            n_intervals=0
+        )
+    ])
 
 # Dash App Setup
 app = dash.Dash(__name__)
-app.layout = html.Div([
-    html.H1("Hybrid System Dashboard", style={'textAlign': 'center'}),
+app.layout = build_layout()
 
-    # Alert Message
-    html.Div(id="alert-message", style={'textAlign': 'center', 'color': 'red', 'fontSize': '20px'}),
+# Numbers embedded in free-form serial lines, e.g. "Temp: 24.5 C, Hum: 51 %"
+_NUM_RE = re.compile(r"[-+]?\d*\.\d+|\d+")
+# A plain decimal field. float() alone would also accept "nan", "inf" and "1_0"
+_FIELD_RE = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)\s*")
 
-    # Live Mode Toggle
-    html.Div([
-        html.Label("Live Mode:"),
-        dcc.RadioItems(
-            id='live-mode',
-            options=[
-                {'label': 'ON (Real-Time Updates)', 'value': 'on'},
-                {'label': 'OFF (Pause Graph)', 'value': 'off'}
-            ],
-            value='on',
-            inline=True
-        )
-    ], style={'textAlign': 'center', 'margin': '10px'}),
-
-    # Time Range Filter
-    html.Label("Select Time Range:"),
-    dcc.Dropdown(
-        id='time-filter',
-        options=[
-            {'label': 'Last 5 minutes', 'value': '5'},
-            {'label': 'Last 10 minutes', 'value': '10'},
-            {'label': 'Last 30 minutes', 'value': '30'},
-            {'label': 'Show All', 'value': 'all'}
-        ],
-        value='all',
-        clearable=False,
-        style={'width': '50%'}
-    ),
-
-    # Real-Time Statistics
-    html.Div([
-        html.H3("Current Sensor Data"),
-        html.P(id="current-temp"),
-        html.P(id="current-hum"),
-        html.H3("Statistics"),
-        html.P(id="avg-temp"),
-        html.P(id="avg-hum"),
-        html.P(id="max-temp"),
-        html.P(id="min-temp")
-    ], style={'textAlign': 'center', 'border': '2px solid #ccc', 'padding': '10px', 'margin': '10px'}),
-
-    dcc.Graph(id='live-graph', config={'scrollZoom': True}),
-
-    html.Div([
-        html.Button("Download CSV", id="download-btn"),
-        dcc.Download(id="download-dataframe-csv"),
-    ], style={'textAlign': 'center', 'margin': '20px'}),
-
-    dcc.Interval(
-        id='interval-component',
-        interval=2000,  # Update every 2 seconds
-        n_intervals=0
-    )
-])
+def parse_line(line):
+    """ Parses a serial line into (temp, hum), trying the plain "temp,hum" format before the regex. """
+    parts = line.split(",")
+    if len(parts) >= 2 and _FIELD_RE.fullmatch(parts[0]) and _FIELD_RE.fullmatch(parts[1]):
+        return float(parts[0]), float(parts[1])
+
+    matches = _NUM_RE.findall(line)
+    if len(matches) < 2:
+        return None
+    return float(matches[0]), float(matches[1])
+
+# Bytes received after the last complete serial line
+_rx_buf = bytearray()
 
 # Function to Read Data from Arduino or Simulate Data on Railway
 def read_serial_data():
     """ Reads serial data if running locally, otherwise generates simulated data on Railway. """
-    if ser is None:  # If running on Railway, return fake sensor values
+    global _rx_buf
+    if ser is None:  # If running on Railway, generate fake sensor values
         temp = round(random.uniform(20, 30), 2)
         hum = round(random.uniform(40, 60), 2)
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
 
-        # Save simulated data to CSV
-        with open(CSV_FILE, "a") as file:
-            file.write(f"{timestamp},{temp},{hum}\n")
+        # Save simulated data to CSV and queue it
+        record_sample(temp, hum)
 
         print(f"🌐 Railway Mode: Simulated Temp: {temp}°C, Hum: {hum}%")
-        return temp, hum  # Fake values for Railway
+        return
 
-    while ser and ser.in_waiting:  # Only read serial data if available
-        try:
-            line = ser.readline().decode().strip()
-            print(f"Raw Serial Data: {line}")
+    # Drain everything buffered in one read, or wait (up to the port timeout) for the next byte
+    _rx_buf += ser.read(ser.in_waiting or 1)
+    *lines, _rx_buf = _rx_buf.split(b"\n")  # Keep the trailing partial line for next time
 
-            import re
-            matches = re.findall(r"[-+]?\d*\.\d+|\d+", line)
+    for raw in lines:
+        line = raw.decode("ascii", "ignore").strip()
+        print(f"Raw Serial Data: {line}")
 
-            if len(matches) < 2:
-                print("Warning: Could not find both Temperature and Humidity, skipping...")
-                continue
+        sample = parse_line(line)
 
-            temp = float(matches[0])
-            hum = float(matches[1])
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        if sample is None:
+            print("Warning: Could not find both Temperature and Humidity, skipping...")
+            continue
 
-            # Save to CSV
-            with open(CSV_FILE, "a") as file:
-                file.write(f"{timestamp},{temp},{hum}\n")
+        temp, hum = sample
 
-            return temp, hum
+        # Save to CSV and queue it
+        record_sample(temp, hum)
 
-        except ValueError:
-            print("Error: Invalid number format, skipping...")
-        except IndexError:
-            print("Error: Data format issue, skipping...")
+SIMULATION_INTERVAL = 2  # Seconds between simulated samples on Railway
+
+def serial_loop():
+    """ Background ingestion loop so a slow serial port never stalls the dashboard callbacks. """
+    while True:
+        try:
+            read_serial_data()
+        except OSError as e:  # pyserial's SerialException is an OSError
+            print(f"❌ Error: Serial read failed ({e}), retrying...")
+            time.sleep(1)
+        except Exception as e:  # Anything else (e.g. the CSV closed at exit) must not kill ingestion
+            print(f"❌ Error: Could not record sample ({e!r}), retrying...")
+            time.sleep(1)
+
+        if ser is None:
+            time.sleep(SIMULATION_INTERVAL)
+
+_started = False
+_START_LOCK = threading.Lock()
+
+def start_ingest():
+    """ Opens the CSV writer, loads the history and starts the serial thread, once per process. """
+    # Runs on the first request rather than at import: the debug reloader's watcher process
+    # imports this module too but never serves, so it must not read the port or append to the CSV
+    global _started, _ARCHIVES, _CSV_FH, _csv_size, _snapshot_ok
+    if _started:  # Already running: don't make every request queue on the lock
+        return
+
+    with _START_LOCK:
+        if _started:
+            return
+
+        # Railway storage is ephemeral, so nothing is written to disk there.
+        # If the CSV can't be opened this raises and the next request tries again.
+        if not ON_RAILWAY:
+            rollover_csv()
+            _ARCHIVES = tuple(sorted(glob.glob(ARCHIVE_PATTERN)))
+            _CSV_FH = open(CSV_FILE, "a", buffering=1 << 16)
+            if _CSV_FH.tell() == 0:  # New or empty file: write the header before anything else
+                _CSV_FH.write("Timestamp,Temperature,Humidity\n")
+                _CSV_FH.flush()
+            _csv_size = _CSV_FH.tell()
+            atexit.register(close_csv)
+
+            try:
+                load_history()
+            except (OSError, ValueError) as e:  # e.g. a row cut short by a power loss
+                # Keep recording new samples; the CSV still holds the old ones
+                print(f"❌ Error: Could not load {CSV_FILE} ({e}), starting with an empty history.")
+                _snapshot_ok = False
+            atexit.register(shutdown_snapshot)
+
+            if _ARCHIVES:
+                threading.Thread(target=summarize_archives, args=(_ARCHIVES,), daemon=True).start()
+
+        threading.Thread(target=serial_loop, daemon=True).start()
+        _started = True
+
+app.server.before_request(start_ingest)
+
+def window_start(selected_range, ts):
+    """ Returns the index of the first sample in the timestamp view ts inside the selected time range. """
+    if selected_range == "all":
+        return 0
+
+    # Samples are appended in time order, so a binary search finds the window start
+    cutoff = time.time() - int(selected_range) * 60
+    return int(np.searchsorted(ts, cutoff))
+
+# Plotting limits
+MAX_PLOT_POINTS = 2000  # Downsample traces beyond this many points
+WEBGL_THRESHOLD = 1000  # Use Scattergl above this many points
+
+# Identifies this process in graph cursors, so a browser tab that outlives a restart gets a fresh figure
+_PROCESS_TOKEN = os.urandom(8).hex()
+
+# Last (key, figure output), where the key is the (range, window start, samples recorded, archives shown) it was built from.
+# Kept as one tuple and replaced in a single assignment, so concurrent callbacks never see a mismatched pair.
+_last_render = (None, None)
+
+def downsample(*columns):
+    """ Keeps at most MAX_PLOT_POINTS evenly spaced samples of each column, striding back from the newest so it is always kept. """
+    count = len(columns[0])
+    if count <= MAX_PLOT_POINTS:
+        return columns
+    step = -(-count // MAX_PLOT_POINTS)
+    return tuple(column[::-step][::-1] for column in columns)
+
+def build_figure(ts, temps, hums, archives=None):
+    """ Builds the graph from the given samples, after the archive summary if given; returns (figure, points per trace, downsampled). """
+    # Downsample long histories on the raw arrays, so only the kept timestamps get converted
+    total = len(ts)
+    ts, temps, hums = downsample(ts, temps, hums)
+    if archives is not None:
+        # The archive points are already downsampled, so prepending them stays cheap
+        archived_ts, archived_temps, archived_hums, archived_stats = archives
+        total += archived_stats["n"]
+        ts, temps, hums = downsample(
+            np.concatenate([archived_ts, ts]),
+            np.concatenate([archived_temps, temps]),
+            np.concatenate([archived_hums, hums]),
+        )
+    times = to_datetime(ts)
 
-    return None, None
+    # Switch to WebGL rendering once SVG gets sluggish
+    Scatter = go.Scattergl if len(ts) > WEBGL_THRESHOLD else go.Scatter
 
-# Callback to Update Graph, Statistics, and Alerts
+    fig = go.Figure()
+    fig.add_trace(Scatter(x=times, y=temps, mode='lines+markers', name='Temperature (°C)', line=dict(color='red')))
+    fig.add_trace(Scatter(x=times, y=hums, mode='lines+markers', name='Humidity (%)', line=dict(color='blue')))
+    fig.update_layout(title="Real-Time Sensor Data (Updated Every 2s)", xaxis_title="Time", yaxis_title="Values", template="plotly_dark", uirevision='constant')
+    return fig, len(ts), len(ts) < total
+
+def render(selected_range, ts, temps, hums, stats, start):
+    """ Returns the full figure for the selected range and the graph cursor describing what it contains. """
+    global _last_render
+
+    # Nothing new arrived and the window hasn't moved: the last figure is still current
+    archives = _archive_summary if selected_range == "all" else None
+    key = (selected_range, start, stats["n"], archives is not None)
+    last_key, last_out = _last_render
+    if key == last_key:
+        return last_out
+
+    fig, points, decimated = build_figure(ts[start:], temps[start:], hums[start:], archives)
+    cursor = {
+        "token": _PROCESS_TOKEN,  # Process that built the figure
+        "range": selected_range,  # Time range the figure shows
+        "n": stats["n"],  # Samples recorded when the figure was last synced
+        "first": stats["n"] - (len(ts) - start),  # Sample number of the oldest sample in the window
+        "points": points,  # Points per trace in the client's figure
+        "decimated": decimated,
+        "archived": archives is not None,  # Whether the archive summary was ready and drawn
+    }
+    _last_render = (key, (fig, cursor))
+    return fig, cursor
+
+# Stop the interval from firing at all while live mode is off
+app.clientside_callback(
+    "function(mode) { return mode === 'off'; }",
+    Output('interval-component', 'disabled'),
+    Input('live-mode', 'value')
+)
+
+# Callback to Build the Full Graph when the time range changes or live mode resumes
 @app.callback(
     [Output('live-graph', 'figure'),
-     Output('current-temp', 'children'),
-     Output('current-hum', 'children'),
-     Output('avg-temp', 'children'),
-     Output('avg-hum', 'children'),
-     Output('max-temp', 'children'),
-     Output('min-temp', 'children'),
-     Output('alert-message', 'children')],
-    [Input('interval-component', 'n_intervals'),
-     Input('time-filter', 'value'),
+     Output('graph-cursor', 'data')],
+    [Input('time-filter', 'value'),
      Input('live-mode', 'value')]
 )
-def update_dashboard(n, selected_range, live_mode):
+def render_graph(selected_range, live_mode):
     if live_mode == "off":
-        return dash.no_update
-
-    temp, hum = read_serial_data()
+        return [dash.no_update] * 2
 
-    # Ensure CSV exists and is not empty
-    if os.path.exists(CSV_FILE) and os.path.getsize(CSV_FILE) > 0:
-        df = pd.read_csv(CSV_FILE)
-        df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors='coerce')
+    drain_queue()
+    ts, temps, hums, stats = read_history()
+    return render(selected_range, ts, temps, hums, stats, window_start(selected_range, ts))
 
-        if selected_range != "all":
-            time_limit = pd.Timestamp.now() - pd.to_timedelta(int(selected_range), unit='m')
-            df = df[df["Timestamp"] >= time_limit]
+# Callback to Append New Samples to the Graph and Publish Statistics
+@app.callback(
+    [Output('live-graph', 'figure', allow_duplicate=True),
+     Output('live-graph', 'extendData'),
+     Output('graph-cursor', 'data', allow_duplicate=True),
+     Output('stats-store', 'data')],
+    [Input('interval-component', 'n_intervals')],
+    [State('time-filter', 'value'),
+     State('live-mode', 'value'),
+     State('graph-cursor', 'data')],
+    prevent_initial_call=True
+)
+def update_dashboard(n, selected_range, live_mode, cursor):
+    if live_mode == "off":  # Paused: leave every output untouched
+        return [dash.no_update] * 4
+
+    drain_queue()
+    ts, temps, hums, stats = read_history()
+    start = window_start(selected_range, ts)
+    count = len(ts) - start  # Samples in the selected window
+    first = stats["n"] - count  # Sample number of the oldest sample in the window
+
+    # Decide whether the client's figure can be extended or has to be redrawn
+    figure = extend = dash.no_update
+    new = 0
+    if (not isinstance(cursor, dict) or cursor.get("token") != _PROCESS_TOKEN
+            or cursor["range"] != selected_range or stats["n"] < cursor["n"]):
+        # No figure yet, or one from another server process or time range: its counts mean nothing here
+        rebuild = True
     else:
-        df = pd.DataFrame(columns=["Timestamp", "Temperature", "Humidity"])
-
-    if df.empty or "Temperature" not in df.columns:
-        return go.Figure(), "Temperature: --", "Humidity: --", "Avg Temp: --", "Avg Hum: --", "Max Temp: --", "Min Temp: --", ""
+        new = min(stats["n"] - cursor["n"], len(ts))
+        if selected_range == "all":
+            # Streamed points aren't downsampled, so re-decimate once they double the plot budget.
+            # Also redraw once the archives finish loading in the background.
+            rebuild = (cursor["points"] + new > 2 * MAX_PLOT_POINTS
+                       or cursor["archived"] != (_archive_summary is not None))
+        else:
+            # A downsampled window can't be trimmed point for point, so redraw it whenever it changes
+            moved = new > 0 or first != cursor["first"]
+            rebuild = moved and (cursor["decimated"] or count > MAX_PLOT_POINTS)
+
+    if rebuild:
+        figure, cursor = render(selected_range, ts, temps, hums, stats, start)
+    elif new > 0 or (selected_range != "all" and first != cursor["first"]):
+        # Only send the samples recorded since the client's figure was last updated
+        tail = len(ts) - new
+        data = {
+            'x': [to_datetime(ts[tail:]).tolist()] * 2,
+            'y': [temps[tail:], hums[tail:]],
+        }
+        extend = [data, [0, 1]]
+        points = cursor["points"] + new
+        if selected_range != "all":
+            # Let the browser drop points that fell out of the window, even when nothing new arrived
+            extend.append(count)
+            points = count
+        cursor = dict(cursor, n=stats["n"], first=first, points=points)
 
     # Compute statistics safely
-    latest_temp = df["Temperature"].iloc[-1]
-    latest_hum = df["Humidity"].iloc[-1]
-    avg_temp = df["Temperature"].mean()
-    avg_hum = df["Humidity"].mean()
-    max_temp = df["Temperature"].max()
-    min_temp = df["Temperature"].min()
-
-    alert = ""
-    if latest_temp > 35:
-        alert = "⚠️ WARNING: High Temperature! (> 35°C)"
-    elif latest_hum > 80:
-        alert = "⚠️ WARNING: High Humidity! (> 80%)"
-
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=df["Timestamp"], y=df["Temperature"], mode='lines+markers', name='Temperature (°C)', line=dict(color='red')))
-    fig.add_trace(go.Scatter(x=df["Timestamp"], y=df["Humidity"], mode='lines+markers', name='Humidity (%)', line=dict(color='blue')))
-    fig.update_layout(title="Real-Time Sensor Data (Updated Every 2s)", xaxis_title="Time", yaxis_title="Values", template="plotly_dark")
+    archives = _archive_summary
+    if selected_range == "all" and not ON_RAILWAY:
+        # Full history: combine the running statistics with the archive totals instead of scanning every row
+        totals = stats if archives is None else combine_stats(stats, archives[3])
+        if totals["n"] == 0:
+            return figure, extend, cursor, None
+        if len(ts):
+            latest_temp, latest_hum = temps[-1], hums[-1]
+        else:  # Nothing recorded since the startup rollover: the newest archived sample is the latest
+            latest_temp, latest_hum = archives[1][-1], archives[2][-1]
+        avg_temp = totals["tsum"] / totals["n"]
+        avg_hum = totals["hsum"] / totals["n"]
+        max_temp = totals["tmax"]
+        min_temp = totals["tmin"]
+    else:
+        # Time windows, and Railway where the ring buffer no longer holds every sample ever seen
+        if start == len(ts):
+            return figure, extend, cursor, None
+        latest_temp, latest_hum = temps[-1], hums[-1]
+        temps, hums = temps[start:], hums[start:]
+        avg_temp = temps.mean(dtype=np.float64)
+        avg_hum = hums.mean(dtype=np.float64)
+        max_temp = temps.max()
+        min_temp = temps.min()
+
+    summary = {
+        "temp": float(latest_temp), "hum": float(latest_hum),
+        "avg_temp": float(avg_temp), "avg_hum": float(avg_hum),
+        "max_temp": float(max_temp), "min_temp": float(min_temp),
+    }
+    return figure, extend, cursor, summary
+
+# Render Statistics and Alerts in the browser from the small stats payload
+app.clientside_callback(
+    """
+    function(d) {
+        if (!d) {
+            return ["Temperature: --", "Humidity: --", "Avg Temp: --", "Avg Hum: --", "Max Temp: --", "Min Temp: --", ""];
+        }
+        var alert = "";
+        if (d.temp > 35) {
+            alert = "⚠️ WARNING: High Temperature! (> 35°C)";
+        } else if (d.hum > 80) {
+            alert = "⚠️ WARNING: High Humidity! (> 80%)";
+        }
+        return [
+            "Temperature: " + d.temp + "°C",
+            "Humidity: " + d.hum + "%",
+            "Avg Temp: " + d.avg_temp.toFixed(2) + "°C",
+            "Avg Hum: " + d.avg_hum.toFixed(2) + "%",
+            "Max Temp: " + d.max_temp + "°C",
+            "Min Temp: " + d.min_temp + "°C",
+            alert
+        ];
+    }
+    """,
+    [Output('current-temp', 'children'),
+     Output('current-hum', 'children'),
+     Output('avg-temp', 'children'),
+     Output('avg-hum', 'children'),
+     Output('max-temp', 'children'),
+     Output('min-temp', 'children'),
+     Output('alert-message', 'children')],
+    Input('stats-store', 'data')
+)
 
-    return fig, f"Temperature: {latest_temp}°C", f"Humidity: {latest_hum}%", f"Avg Temp: {avg_temp:.2f}°C", f"Avg Hum: {avg_hum:.2f}%", f"Max Temp: {max_temp}°C", f"Min Temp: {min_temp}°C", alert
+@functools.lru_cache(maxsize=1)
+def csv_bytes(n):
+    """ Serializes the in-memory history as CSV. Keyed on the sample count n, so it's rebuilt only after new samples. """
+    ts, temps, hums, _ = read_history()
+    df = pd.DataFrame({
+        "Timestamp": to_datetime(ts).strftime(TIME_FORMAT),
+        "Temperature": temps,
+        "Humidity": hums,
+    })
+    return df.to_csv(index=False).encode()
+
+# Callback to Download the Sensor History as CSV
+@app.callback(
+    Output('download-dataframe-csv', 'data'),
+    Input('download-btn', 'n_clicks'),
+    prevent_initial_call=True
+)
+def download_csv(n_clicks):
+    drain_queue()
+    return dcc.send_bytes(csv_bytes(_stats["n"]), "sensor_data.csv")
 
 if __name__ == '__main__':
     app.run_server(host='0.0.0.0', port=8080, debug=True)